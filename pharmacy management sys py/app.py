@@ -1,4 +1,11 @@
-from flask import Flask, jsonify, request, send_from_directory, session
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Deque, Dict
+
+from flask import Flask, g, jsonify, request, send_from_directory, session
 from flask_cors import CORS
 
 from database import (
@@ -9,13 +16,25 @@ from database import (
 	update_medicine,
 	delete_medicine,
 	record_sale,
-    
+	record_sales_batch,
 	get_summary_stats,
 	get_dashboard_stats,
 	add_user,
 	get_user_by_username,
+	update_user_password,
+	get_user_stores,
+	set_user_stores,
 	list_sales,
 	get_sale_details,
+	DEFAULT_STORE,
+	create_store,
+	list_stores,
+	set_current_store,
+	reset_current_store,
+	get_summary_stats_all_stores,
+	get_dashboard_stats_all_stores,
+	list_sales_all_stores,
+	get_audit_log,
 )
 
 
@@ -23,6 +42,60 @@ app = Flask(__name__, static_folder="static", static_url_path="/static")
 CORS(app)
 app.secret_key = "development-secret-key-change-me"
 
+# Password hashing is CPU-heavy; a small dedicated pool keeps a burst of logins
+# (e.g. at shift change) from starving checkout requests. Half the cores at most.
+LOGIN_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+# Nice value for login pool threads so checkout wins any contention for the CPU
+LOGIN_THREAD_NICE = 10
+# Logins verifying or queued at once. A queued login waits up to LOGIN_TIMEOUT_SECONDS
+# for a worker, so a shift-change burst is served in turn rather than turned away;
+# only beyond this bound does /api/login answer 503.
+LOGIN_MAX_PENDING = 64
+LOGIN_TIMEOUT_SECONDS = 15.0
+# Failed password checks allowed per username in LOGIN_RATE_WINDOW seconds
+LOGIN_RATE_LIMIT = 5
+LOGIN_RATE_WINDOW = 60.0
+
+
+def _lower_login_thread_priority() -> None:
+	"""Login pool initializer: deprioritise hashing threads."""
+	# Linux applies nice values per thread; elsewhere this is skipped
+	try:
+		os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), LOGIN_THREAD_NICE)
+	except (AttributeError, OSError):
+		pass
+
+
+_login_executor = ThreadPoolExecutor(
+	max_workers=LOGIN_WORKERS,
+	thread_name_prefix="login-verify",
+	initializer=_lower_login_thread_priority,
+)
+_login_slots = threading.BoundedSemaphore(LOGIN_MAX_PENDING)
+_login_attempts: Dict[str, Deque[float]] = {}
+_login_attempts_lock = threading.Lock()
+
+
+@app.before_request
+def bind_store():
+	"""Route this request's database calls to the store in the URL, header or session."""
+	session_store = session.get("store_id") or DEFAULT_STORE
+	store_id = (request.args.get("store") or request.headers.get("X-Store-Id") or session_store).strip()
+	# Staff are bound to the store they logged in to; only admins may switch stores per request
+	if store_id != session_store and session.get("user_id") and session.get("role") != "admin":
+		return jsonify({"success": False, "message": "Forbidden"}), 403
+	try:
+		g.store_token = set_current_store(store_id)
+	except ValueError as exc:
+		return jsonify({"success": False, "message": str(exc)}), 404
+
+
+@app.teardown_request
+def unbind_store(exc):
+	token = g.pop("store_token", None)
+	if token is not None:
+		reset_current_store(token)
+
 
 @app.route("/")
 def index() -> any:
@@ -97,6 +170,21 @@ def api_delete_medicine(medicine_id: int):
 		return jsonify({"success": False, "message": str(exc)}), 400
 
 
+@app.get("/api/audit")
+def api_audit_log():
+	"""Inventory and price change history, filterable by medicine_id and a from/to range."""
+	if not session.get("user_id") or session.get("role") != "admin":
+		return jsonify({"success": False, "message": "Forbidden"}), 403
+	try:
+		medicine_id = request.args.get("medicine_id", type=int)
+		# SQLite treats a negative LIMIT as unlimited, so clamp both ends
+		limit = max(1, min(request.args.get("limit", 500, type=int), 5000))
+		entries = get_audit_log(medicine_id, request.args.get("from"), request.args.get("to"), limit)
+		return jsonify({"success": True, "data": entries})
+	except Exception as exc:
+		return jsonify({"success": False, "message": str(exc)}), 400
+
+
 @app.post("/api/sales/create")
 def api_create_sale():
 	if not session.get("user_id"):
@@ -114,6 +202,30 @@ def api_create_sale():
 		return jsonify({"success": False, "message": str(exc)}), 400
 
 
+# Upper bound on sales accepted per sync upload; terminals split larger backlogs
+MAX_SYNC_BATCH = 1000
+
+
+@app.post("/api/sales/batch")
+def api_sync_sales_batch():
+	"""Apply sales queued by a terminal while offline; results are reported per sale."""
+	if not session.get("user_id"):
+		return jsonify({"success": False, "message": "Unauthorized"}), 401
+	body = request.get_json(silent=True) or {}
+	try:
+		sales = body.get("sales") or []
+		if not isinstance(sales, list) or not all(isinstance(s, dict) for s in sales):
+			return jsonify({"success": False, "message": "sales must be a list of objects"}), 400
+		if len(sales) > MAX_SYNC_BATCH:
+			return jsonify({"success": False, "message": f"At most {MAX_SYNC_BATCH} sales per batch"}), 413
+
+		results = record_sales_batch(sales)
+		counts = {"created": 0, "duplicate": 0, "conflict": 0}
+		for result in results:
+			counts[result["status"]] += 1
+		return jsonify({"success": True, "results": results, **counts})
+	except Exception as exc:
+		return jsonify({"success": False, "message": str(exc)}), 400
 
 
 
@@ -150,6 +262,50 @@ def api_sale_details(sale_id: int):
 		return jsonify({"success": False, "message": str(exc)}), 404
 
 
+@app.get("/api/stores")
+def api_list_stores():
+	if not session.get("user_id"):
+		return jsonify({"success": False, "message": "Unauthorized"}), 401
+	return jsonify({"success": True, "data": list_stores(), "current": session.get("store_id") or DEFAULT_STORE})
+
+
+@app.post("/api/stores")
+def api_create_store():
+	if not session.get("user_id") or session.get("role") != "admin":
+		return jsonify({"success": False, "message": "Forbidden"}), 403
+	body = request.get_json(silent=True) or {}
+	try:
+		store_id = (body.get("store_id") or "").strip()
+		if not store_id:
+			return jsonify({"success": False, "message": "store_id is required"}), 400
+		create_store(store_id)
+		return jsonify({"success": True, "store_id": store_id})
+	except Exception as exc:
+		return jsonify({"success": False, "message": str(exc)}), 400
+
+
+# Head-office reports fan out across every store's shard and merge the results
+@app.get("/api/head-office/summary")
+def api_head_office_summary():
+	if not session.get("user_id") or session.get("role") != "admin":
+		return jsonify({"success": False, "message": "Forbidden"}), 403
+	return jsonify({"success": True, "data": get_summary_stats_all_stores()})
+
+
+@app.get("/api/head-office/dashboard-stats")
+def api_head_office_dashboard_stats():
+	if not session.get("user_id") or session.get("role") != "admin":
+		return jsonify({"success": False, "message": "Forbidden"}), 403
+	return jsonify({"success": True, "data": get_dashboard_stats_all_stores()})
+
+
+@app.get("/api/head-office/sales")
+def api_head_office_sales():
+	if not session.get("user_id") or session.get("role") != "admin":
+		return jsonify({"success": False, "message": "Forbidden"}), 403
+	return jsonify({"success": True, "data": list_sales_all_stores()})
+
+
 @app.post("/api/register")
 def api_register():
 	body = request.get_json(silent=True) or {}
@@ -161,27 +317,134 @@ def api_register():
 		username = (body.get("username") or "").strip()
 		password = body.get("password") or ""
 		role = (body.get("role") or "staff").strip() or "staff"
+		stores = body.get("stores") or []
 		if not username or not password:
 			return jsonify({"success": False, "message": "Username and password are required"}), 400
+		if not isinstance(stores, list) or not all(isinstance(s, str) for s in stores):
+			return jsonify({"success": False, "message": "stores must be a list of store ids"}), 400
+		known_stores = set(list_stores())
+		unknown = [s for s in stores if s not in known_stores]
+		if unknown:
+			return jsonify({"success": False, "message": f"Unknown store: {unknown[0]}"}), 400
 		password_hash = generate_password_hash(password)
 		user_id = add_user(username, password_hash, role)
+		if stores:
+			set_user_stores(user_id, stores)
 		return jsonify({"success": True, "user_id": user_id})
 	except Exception as exc:
 		return jsonify({"success": False, "message": str(exc)}), 400
 
 
+@app.put("/api/users/<int:user_id>/stores")
+def api_set_user_stores(user_id: int):
+	"""Admin: set which stores a staff user may log in to."""
+	if not session.get("user_id") or session.get("role") != "admin":
+		return jsonify({"success": False, "message": "Forbidden"}), 403
+	body = request.get_json(silent=True) or {}
+	try:
+		stores = body.get("stores")
+		if not isinstance(stores, list) or not stores or not all(isinstance(s, str) for s in stores):
+			return jsonify({"success": False, "message": "stores must be a non-empty list of store ids"}), 400
+		set_user_stores(user_id, stores)
+		return jsonify({"success": True, "stores": get_user_stores(user_id)})
+	except Exception as exc:
+		return jsonify({"success": False, "message": str(exc)}), 400
+
+
+def _login_rate_limited(username: str) -> bool:
+	"""Return True if the username has used up its failed attempts for the window."""
+	now = time.monotonic()
+	with _login_attempts_lock:
+		attempts = _login_attempts.get(username)
+		if not attempts:
+			return False
+		while attempts and now - attempts[0] > LOGIN_RATE_WINDOW:
+			attempts.popleft()
+		return len(attempts) >= LOGIN_RATE_LIMIT
+
+
+def _record_failed_login(username: str) -> None:
+	"""Count a password check that failed against the username's limit."""
+	now = time.monotonic()
+	with _login_attempts_lock:
+		_login_attempts.setdefault(username, deque()).append(now)
+		# Drop idle usernames so the table does not grow without bound
+		for name in [n for n, a in _login_attempts.items() if not a or now - a[-1] > LOGIN_RATE_WINDOW]:
+			del _login_attempts[name]
+
+
+def _verify_credentials(username: str, password: str):
+	"""Return the user row if the password matches, else None. Runs on the login pool."""
+	from werkzeug.security import check_password_hash
+	user = get_user_by_username(username)
+	if not user or not check_password_hash(user["password_hash"], password):
+		return None
+	return user
+
+
+def _run_login_check(username: str, check, *args):
+	"""
+	Run a credential check on the login pool behind the per-username rate limit and
+	the LOGIN_MAX_PENDING concurrency limit.
+
+	Returns (result, None), or (None, error response) when limited or timed out.
+	Busy or timed-out answers do not count against the rate limit; callers record
+	failed password checks with _record_failed_login. Anyone who knows a username can
+	still lock it out for LOGIN_RATE_WINDOW seconds with wrong passwords. That is the
+	accepted price of stopping password guessing without per-client state.
+	"""
+	if _login_rate_limited(username):
+		resp = jsonify({"success": False, "message": "Too many login attempts, try again later"})
+		return None, (resp, 429, {"Retry-After": str(int(LOGIN_RATE_WINDOW))})
+	busy = (jsonify({"success": False, "message": "Login busy, try again"}), 503, {"Retry-After": "1"})
+	if not _login_slots.acquire(blocking=False):
+		return None, busy
+	try:
+		future = _login_executor.submit(check, *args)
+	except Exception:
+		_login_slots.release()
+		raise
+	# The slot is held until hashing finishes, even if this request stops waiting
+	future.add_done_callback(lambda _: _login_slots.release())
+	try:
+		return future.result(timeout=LOGIN_TIMEOUT_SECONDS), None
+	except FutureTimeoutError:
+		# Don't spend CPU hashing for a client that has been told to retry
+		future.cancel()
+		return None, busy
+
+
 @app.post("/api/login")
 def api_login():
 	body = request.get_json(silent=True) or {}
-	from werkzeug.security import check_password_hash
 	username = (body.get("username") or "").strip()
 	password = body.get("password") or ""
-	user = get_user_by_username(username)
-	if not user or not check_password_hash(user["password_hash"], password):
+	store_id = body.get("store_id") or request.args.get("store")
+	if store_id is not None and not isinstance(store_id, str):
+		return jsonify({"success": False, "message": "store_id must be a string"}), 400
+	store_id = (store_id or "").strip()
+	user, error = _run_login_check(username, _verify_credentials, username, password)
+	if error:
+		return error
+	if not user:
+		_record_failed_login(username)
 		return jsonify({"success": False, "message": "Invalid credentials"}), 401
+	with _login_attempts_lock:
+		_login_attempts.pop(username, None)
+	is_admin = user.get("role") == "admin"
+	allowed_stores = None if is_admin else get_user_stores(int(user["id"]))
+	if not store_id:
+		# The login form sends no store; use the user's first assigned store
+		store_id = DEFAULT_STORE if is_admin else allowed_stores[0]
+	if store_id not in list_stores():
+		return jsonify({"success": False, "message": f"Unknown store: {store_id}"}), 404
+	# Admins may use any store; staff only the stores assigned to them
+	if not is_admin and store_id not in allowed_stores:
+		return jsonify({"success": False, "message": "Not allowed to access this store"}), 403
 	session["user_id"] = int(user["id"])  # type: ignore[index]
 	session["role"] = user.get("role", "staff")
-	return jsonify({"success": True})
+	session["store_id"] = store_id
+	return jsonify({"success": True, "store_id": store_id})
 
 
 @app.get("/api/logout")
@@ -207,13 +470,7 @@ def api_reset_admin():
 		phash = generate_password_hash(password)
 		if user:
 			# Update existing
-			from database import get_db_connection
-			conn = get_db_connection()
-			try:
-				conn.execute("UPDATE users SET password_hash = ? WHERE id = ?", (phash, user["id"]))
-				conn.commit()
-			finally:
-				conn.close()
+			update_user_password(username, phash)
 		else:
 			add_user(username, phash)
 		return jsonify({"success": True, "message": "Admin credentials set."})
@@ -240,40 +497,39 @@ def api_debug_user():
 		return jsonify({"success": False, "message": str(exc)}), 400
 
 
+def _diagnose_credentials(username: str, password: str) -> Dict[str, Any]:
+	"""Credential check details for /api/debug-login. Runs on the login pool."""
+	from werkzeug.security import check_password_hash
+	user = get_user_by_username(username)
+	if not user:
+		return {"success": True, "user_exists": False}
+	stored_hash = user.get("password_hash")
+	hash_prefix = stored_hash[:12] if stored_hash else None
+	try:
+		check = check_password_hash(stored_hash, password)
+	except Exception as exc:
+		return {"success": False, "error": str(exc), "user_exists": True, "hash_prefix": hash_prefix}
+	return {"success": True, "user_exists": True, "hash_prefix": hash_prefix, "check_result": check}
+
+
 @app.post("/api/debug-login")
 def api_debug_login():
 	"""Dev helper: diagnose credential check for a username/password."""
 	body = request.get_json(silent=True) or {}
-	from werkzeug.security import check_password_hash
 	username = (body.get("username") or "").strip()
 	password = body.get("password") or ""
-	user = get_user_by_username(username)
-	if not user:
-		return jsonify({
-			"success": True,
-			"user_exists": False,
+	# Same limits as /api/login, so this cannot be used to bypass them
+	result, error = _run_login_check(username, _diagnose_credentials, username, password)
+	if error:
+		return error
+	if not result.get("check_result"):
+		_record_failed_login(username)
+	if result["success"]:
+		result.update({
 			"received_username_len": len(username),
 			"received_password_len": len(password),
 		})
-	stored_hash = user.get("password_hash")
-	check = False
-	try:
-		check = check_password_hash(stored_hash, password)
-	except Exception as exc:
-		return jsonify({
-			"success": False,
-			"error": str(exc),
-			"user_exists": True,
-			"hash_prefix": stored_hash[:12] if stored_hash else None,
-		})
-	return jsonify({
-		"success": True,
-		"user_exists": True,
-		"hash_prefix": stored_hash[:12] if stored_hash else None,
-		"check_result": check,
-		"received_username_len": len(username),
-		"received_password_len": len(password),
-	})
+	return jsonify(result)
 
 
 if __name__ == "__main__":
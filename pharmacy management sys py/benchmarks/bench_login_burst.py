@@ -0,0 +1,176 @@
+"""
+Benchmark checkout latency while a burst of staff log in at once (shift change).
+
+Serves the app with a threaded werkzeug server on a scratch database, keeps cashiers
+posting /api/sales/create (pausing --think-ms between sales, as at a real counter),
+and fires a burst of concurrent /api/login calls. Prints checkout p50/p99 before and
+during the burst, and login latency and status codes.
+
+With --think-ms 0 the cashiers saturate the CPU on their own, so on a machine with
+fewer free cores than LOGIN_WORKERS any hashing at all shows up in checkout latency.
+
+Run it with the default pool, then with a pool large enough to act like inline
+hashing, to compare:
+	python benchmarks/bench_login_burst.py
+	python benchmarks/bench_login_burst.py --login-workers 64 --login-max-pending 64
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+from init_db import create_tables  # noqa: E402
+
+PASSWORD = "bench-password"
+
+
+class Client:
+	"""HTTP client with its own cookie session."""
+
+	def __init__(self, base_url: str) -> None:
+		self.base_url = base_url
+		self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+	def post(self, path: str, body: Dict[str, Any]) -> int:
+		req = urllib.request.Request(
+			self.base_url + path,
+			data=json.dumps(body).encode(),
+			headers={"Content-Type": "application/json"},
+			method="POST",
+		)
+		try:
+			with self.opener.open(req, timeout=60) as resp:
+				resp.read()
+				return resp.status
+		except urllib.error.HTTPError as exc:
+			return exc.code
+
+
+def percentiles(samples: List[float]) -> Tuple[float, float]:
+	"""Return (p50, p99) in milliseconds."""
+	if len(samples) < 2:
+		return (samples[0] * 1000, samples[0] * 1000) if samples else (0.0, 0.0)
+	cuts = statistics.quantiles(samples, n=100)
+	return cuts[49] * 1000, cuts[98] * 1000
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument("--cashiers", type=int, default=2, help="threads posting sales")
+	parser.add_argument("--logins", type=int, default=40, help="concurrent logins in the burst")
+	parser.add_argument("--baseline-seconds", type=float, default=2.0, help="checkout time before the burst")
+	parser.add_argument("--think-ms", type=float, default=20.0, help="pause between a cashier's sales")
+	parser.add_argument("--login-workers", type=int, default=None, help="override app.LOGIN_WORKERS")
+	parser.add_argument("--login-max-pending", type=int, default=None, help="override app.LOGIN_MAX_PENDING")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		database.DB_PATH = os.path.join(tmp, "pharmacy.db")
+		database.STORES_DIR = os.path.join(tmp, "stores")
+		create_tables(database.DB_PATH)
+		conn = database.get_db_connection()
+		try:
+			conn.execute("UPDATE medicines SET quantity = 100000000")
+			conn.commit()
+		finally:
+			conn.close()
+
+		import app as app_module
+		from werkzeug.security import generate_password_hash
+		from werkzeug.serving import make_server
+
+		if args.login_workers is not None:
+			app_module.LOGIN_WORKERS = args.login_workers
+			app_module._login_executor = ThreadPoolExecutor(
+				max_workers=args.login_workers,
+				thread_name_prefix="login-verify",
+				initializer=app_module._lower_login_thread_priority,
+			)
+		if args.login_max_pending is not None:
+			app_module.LOGIN_MAX_PENDING = args.login_max_pending
+			app_module._login_slots = threading.BoundedSemaphore(args.login_max_pending)
+
+		# One real hash shared by every account; hashing it per user would only slow setup
+		password_hash = generate_password_hash(PASSWORD)
+		for i in range(args.cashiers):
+			database.add_user(f"cashier{i}", password_hash)
+		for i in range(args.logins):
+			database.add_user(f"staff{i}", password_hash)
+
+		# Per-request access logging would dominate the timings
+		logging.getLogger("werkzeug").setLevel(logging.ERROR)
+		server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		base_url = f"http://127.0.0.1:{server.server_port}"
+
+		cashiers = [Client(base_url) for _ in range(args.cashiers)]
+		for i, client in enumerate(cashiers):
+			if client.post("/api/login", {"username": f"cashier{i}", "password": PASSWORD}) != 200:
+				raise SystemExit("cashier login failed")
+
+		latencies: List[Tuple[float, float]] = []
+		errors = Counter()
+		stop = threading.Event()
+
+		def checkout(client: Client) -> None:
+			sale = {"customer_name": "bench", "items": [{"medicine_id": 1, "quantity": 1}]}
+			while not stop.is_set():
+				started = time.perf_counter()
+				status = client.post("/api/sales/create", sale)
+				latencies.append((started, time.perf_counter() - started))
+				if status != 200:
+					errors[status] += 1
+				time.sleep(args.think_ms / 1000)
+
+		threads = [threading.Thread(target=checkout, args=(c,)) for c in cashiers]
+		for t in threads:
+			t.start()
+		time.sleep(args.baseline_seconds)
+
+		burst_start = time.perf_counter()
+		login_status: Counter = Counter()
+		login_latencies: List[float] = []
+
+		def login(i: int) -> int:
+			started = time.perf_counter()
+			status = Client(base_url).post("/api/login", {"username": f"staff{i}", "password": PASSWORD})
+			login_latencies.append(time.perf_counter() - started)
+			return status
+
+		with ThreadPoolExecutor(max_workers=args.logins) as burst:
+			for status in burst.map(login, range(args.logins)):
+				login_status[status] += 1
+		burst_end = time.perf_counter()
+
+		stop.set()
+		for t in threads:
+			t.join()
+		server.shutdown()
+
+	baseline = [d for s, d in latencies if s < burst_start]
+	during = [d for s, d in latencies if burst_start <= s < burst_end]
+	print(f"login pool: workers={app_module.LOGIN_WORKERS} max_pending={app_module.LOGIN_MAX_PENDING}, think {args.think_ms}ms")
+	print("checkout baseline  p50={:7.1f}ms p99={:7.1f}ms n={}".format(*percentiles(baseline), len(baseline)))
+	print("checkout in burst  p50={:7.1f}ms p99={:7.1f}ms n={}".format(*percentiles(during), len(during)))
+	print("login latency      p50={:7.1f}ms p99={:7.1f}ms".format(*percentiles(login_latencies)))
+	print(f"burst of {args.logins} logins took {burst_end - burst_start:.2f}s, status codes {dict(login_status)}")
+	if errors:
+		print(f"checkout errors: {dict(errors)}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,88 @@
+"""
+Benchmark sale throughput: one record_sale call per sale vs record_sales_batch.
+
+Builds a backlog of sales like a terminal would queue while offline and applies it
+to a scratch copy of the schema (pharmacy.db is not touched).
+
+Usage:
+	python benchmarks/bench_sales_batch.py [--sales 5000] [--batch-size 1000] [--items 2]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+from init_db import create_tables  # noqa: E402
+
+
+def build_backlog(count: int, items_per_sale: int, medicine_count: int) -> List[Dict[str, Any]]:
+	"""Return count queued sales, each with a fresh idempotency key."""
+	return [
+		{
+			"idempotency_key": uuid.uuid4().hex,
+			"customer_name": f"Customer {i}",
+			"items": [
+				{"medicine_id": (i + j) % medicine_count + 1, "quantity": 1}
+				for j in range(items_per_sale)
+			],
+		}
+		for i in range(count)
+	]
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument("--sales", type=int, default=5000, help="sales in the backlog")
+	parser.add_argument("--batch-size", type=int, default=1000, help="sales per record_sales_batch call")
+	parser.add_argument("--items", type=int, default=2, help="line items per sale")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		database.DB_PATH = os.path.join(tmp, "pharmacy.db")
+		database.STORES_DIR = os.path.join(tmp, "stores")
+		create_tables(database.DB_PATH)
+		conn = database.get_db_connection()
+		try:
+			# Enough stock that no sale conflicts
+			conn.execute("UPDATE medicines SET quantity = 100000000")
+			medicine_count = conn.execute("SELECT COUNT(*) FROM medicines").fetchone()[0]
+			conn.commit()
+		finally:
+			conn.close()
+
+		backlog = build_backlog(args.sales, args.items, medicine_count)
+		start = time.perf_counter()
+		for sale in backlog:
+			database.record_sale(sale["customer_name"], sale["items"])
+		single = time.perf_counter() - start
+
+		backlog = build_backlog(args.sales, args.items, medicine_count)
+		start = time.perf_counter()
+		created = 0
+		for offset in range(0, len(backlog), args.batch_size):
+			results = database.record_sales_batch(backlog[offset:offset + args.batch_size])
+			created += sum(1 for r in results if r["status"] == "created")
+		batched = time.perf_counter() - start
+		if created != len(backlog):
+			raise SystemExit(f"expected {len(backlog)} created sales, got {created}")
+
+		# Replaying the same backlog must only produce duplicates
+		start = time.perf_counter()
+		for offset in range(0, len(backlog), args.batch_size):
+			database.record_sales_batch(backlog[offset:offset + args.batch_size])
+		replay = time.perf_counter() - start
+
+	print(f"{args.sales} sales x {args.items} items, batch size {args.batch_size}")
+	print(f"record_sale         {args.sales / single:10.0f} sales/s  ({single:.2f}s)")
+	print(f"record_sales_batch  {args.sales / batched:10.0f} sales/s  ({batched:.2f}s)")
+	print(f"replay (duplicates) {args.sales / replay:10.0f} sales/s  ({replay:.2f}s)")
+
+
+if __name__ == "__main__":
+	main()
@@ -1,20 +1,345 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import re
 import sqlite3
-from typing import Any, Dict, List, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
 
 
+T = TypeVar("T")
+
 DB_PATH = "pharmacy.db"
+# The original single-store database is the "main" store; every other branch
+# gets its own SQLite file (shard) under STORES_DIR.
+DEFAULT_STORE = "main"
+STORES_DIR = "stores"
+# Idle connections kept per shard
+POOL_SIZE = 5
+# Threads used by head-office queries to fan out across shards
+FAN_OUT_WORKERS = 8
+# Audit log durability: True writes each audit row in the same transaction as the
+# change; False buffers rows and a background thread writes them in batches
+# (rows still buffered are lost if the process crashes).
+AUDIT_SYNC = False
+AUDIT_BATCH_SIZE = 200
+AUDIT_FLUSH_INTERVAL = 1.0
+# A store whose audit writes keep failing is retried with doubling delays (capped at
+# AUDIT_MAX_BACKOFF seconds); after AUDIT_MAX_FAILURES failures its rows are dropped
+# and the loss is logged, so a broken shard cannot grow the buffer without bound.
+AUDIT_MAX_FAILURES = 5
+AUDIT_MAX_BACKOFF = 60.0
+# Seconds a user row stays cached for login; writes through this module invalidate it
+USER_CACHE_TTL = 300.0
+
+_STORE_ID_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+_current_store: ContextVar[str] = ContextVar("current_store", default=DEFAULT_STORE)
+logger = logging.getLogger(__name__)
+
+
+class _PooledConnection(sqlite3.Connection):
+	"""SQLite connection whose close() hands it back to its shard pool."""
+
+	pool: Optional["_ShardPool"] = None
+
+	def close(self) -> None:
+		if self.pool is None:
+			super().close()
+		else:
+			self.pool.release(self)
+
+
+class _ShardPool:
+	"""Pool of reusable connections to one store's database file."""
+
+	def __init__(self, db_path: str, size: int) -> None:
+		self.db_path = db_path
+		self._idle: "queue.LifoQueue[_PooledConnection]" = queue.LifoQueue(maxsize=size)
+
+	def acquire(self) -> sqlite3.Connection:
+		try:
+			return self._idle.get_nowait()
+		except queue.Empty:
+			pass
+		# Connections move between request threads, one thread at a time
+		conn = sqlite3.connect(self.db_path, factory=_PooledConnection, check_same_thread=False)
+		conn.row_factory = sqlite3.Row
+		# Ensure FK constraints are enforced
+		conn.execute("PRAGMA foreign_keys = ON;")
+		conn.pool = self
+		return conn
+
+	def release(self, conn: _PooledConnection) -> None:
+		# Never hand out a connection with a half-finished transaction
+		if conn.in_transaction:
+			conn.rollback()
+		try:
+			self._idle.put_nowait(conn)
+		except queue.Full:
+			sqlite3.Connection.close(conn)
+
+
+_pools: Dict[str, _ShardPool] = {}
+_pools_lock = threading.Lock()
+_fan_out_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_store_db_path(store_id: str) -> str:
+	"""Return the database file for a store, validating the store id."""
+	if store_id == DEFAULT_STORE:
+		return DB_PATH
+	if not _STORE_ID_RE.match(store_id or ""):
+		raise ValueError(f"Invalid store id: {store_id!r}")
+	return os.path.join(STORES_DIR, f"{store_id}.db")
+
+
+def store_exists(store_id: str) -> bool:
+	"""Return True if the store has a database shard."""
+	if store_id in _pools:
+		return True
+	try:
+		return os.path.exists(get_store_db_path(store_id))
+	except ValueError:
+		return False
+
+
+def list_stores() -> List[str]:
+	"""Return all store ids, the main store first."""
+	stores = [DEFAULT_STORE]
+	if os.path.isdir(STORES_DIR):
+		for filename in sorted(os.listdir(STORES_DIR)):
+			store_id, ext = os.path.splitext(filename)
+			if ext == ".db" and store_id != DEFAULT_STORE and _STORE_ID_RE.match(store_id):
+				stores.append(store_id)
+	return stores
+
+
+def create_store(store_id: str) -> None:
+	"""Create an empty database shard for a new store."""
+	from init_db import create_tables
+
+	db_path = get_store_db_path(store_id)
+	if os.path.exists(db_path):
+		raise ValueError(f"Store {store_id} already exists")
+	os.makedirs(STORES_DIR, exist_ok=True)
+	create_tables(db_path, seed=False)
+
+
+def get_current_store() -> str:
+	"""Return the store the current request (or thread) is bound to."""
+	return _current_store.get()
+
+
+def set_current_store(store_id: str) -> Token:
+	"""Bind the current context to a store; pass the token to reset_current_store."""
+	if not store_exists(store_id):
+		raise ValueError(f"Unknown store: {store_id}")
+	return _current_store.set(store_id)
+
+
+def reset_current_store(token: Token) -> None:
+	"""Undo a set_current_store call."""
+	_current_store.reset(token)
 
 
-def get_db_connection() -> sqlite3.Connection:
+@contextmanager
+def use_store(store_id: str) -> Iterator[None]:
+	"""Run the enclosed database calls against the given store."""
+	token = set_current_store(store_id)
+	try:
+		yield
+	finally:
+		reset_current_store(token)
+
+
+def _get_pool(store_id: str) -> _ShardPool:
+	pool = _pools.get(store_id)
+	if pool is None:
+		with _pools_lock:
+			pool = _pools.get(store_id)
+			if pool is None:
+				db_path = get_store_db_path(store_id)
+				if os.path.exists(db_path):
+					# Bring shards created by older versions up to the current schema
+					from init_db import create_tables
+					create_tables(db_path, seed=False)
+				pool = _ShardPool(db_path, POOL_SIZE)
+				_pools[store_id] = pool
+	return pool
+
+
+def get_db_connection(store_id: Optional[str] = None) -> sqlite3.Connection:
+	"""
+	Return a pooled SQLite connection with row factory set for dict-like access.
+	The connection targets store_id, or the store bound to the current request.
+	Each caller is responsible for closing the connection, which returns it to the pool.
+	"""
+	return _get_pool(store_id or _current_store.get()).acquire()
+
+
+def fan_out(query: Callable[[], T], store_ids: Optional[List[str]] = None) -> Dict[str, T]:
 	"""
-	Return a new SQLite connection to pharmacy.db with row factory set for dict-like access.
-	Each caller is responsible for closing the connection.
+	Run a query function against every store in parallel.
+
+	Returns a dict of store id to that store's result, in store order.
+	"""
+	global _fan_out_executor
+	stores = store_ids or list_stores()
+	if _fan_out_executor is None:
+		with _pools_lock:
+			if _fan_out_executor is None:
+				_fan_out_executor = ThreadPoolExecutor(max_workers=FAN_OUT_WORKERS, thread_name_prefix="store-fan-out")
+
+	def run(store_id: str) -> T:
+		with use_store(store_id):
+			return query()
+
+	return dict(zip(stores, _fan_out_executor.map(run, stores)))
+
+
+_AUDIT_INSERT_SQL = """
+	INSERT INTO medicine_audit_log (medicine_id, action, before_json, after_json, changed_at)
+	VALUES (?, ?, ?, ?, ?)
+"""
+_MEDICINE_COLUMNS = "id, name, manufacturer, batch_no, expiry_date, quantity, price"
+
+
+class _AuditWriter:
+	"""Buffers audit rows per store and writes them in batches from a background thread."""
+
+	def __init__(self) -> None:
+		self._pending: Dict[str, List[tuple]] = {}
+		self._count = 0
+		self._lock = threading.Lock()
+		# Serialises flushes, so a caller flushing before a read also waits for a
+		# batch the background thread has taken but not yet committed
+		self._flush_lock = threading.Lock()
+		self._wakeup = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+		# store id -> (consecutive failures, monotonic time of next attempt)
+		self._failures: Dict[str, Tuple[int, float]] = {}
+
+	def add(self, store_id: str, row: tuple) -> None:
+		with self._lock:
+			self._pending.setdefault(store_id, []).append(row)
+			self._count += 1
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+				self._thread.start()
+			if self._count >= AUDIT_BATCH_SIZE:
+				self._wakeup.set()
+
+	def flush(self) -> None:
+		"""
+		Write all buffered rows, one transaction per store.
+
+		A store that fails keeps its rows buffered and is retried after a backoff; the
+		other stores are still written and the error is logged rather than raised.
+		After AUDIT_MAX_FAILURES consecutive failures the store's rows are dropped.
+		"""
+		with self._flush_lock:
+			with self._lock:
+				pending, self._pending, self._count = self._pending, {}, 0
+			now = time.monotonic()
+			for store_id, rows in pending.items():
+				failures, retry_at = self._failures.get(store_id, (0, 0.0))
+				if now < retry_at:
+					self._requeue(store_id, rows)
+					continue
+				try:
+					conn = get_db_connection(store_id)
+					try:
+						conn.executemany(_AUDIT_INSERT_SQL, rows)
+						conn.commit()
+					finally:
+						conn.close()
+				except Exception:
+					failures += 1
+					if failures >= AUDIT_MAX_FAILURES:
+						logger.exception(
+							"Audit flush failed %d times for store %s; dropping %d audit rows",
+							failures, store_id, len(rows),
+						)
+						self._failures.pop(store_id, None)
+						continue
+					backoff = min(AUDIT_FLUSH_INTERVAL * 2 ** failures, AUDIT_MAX_BACKOFF)
+					logger.exception(
+						"Audit flush failed for store %s; %d rows kept, retrying in %.1fs",
+						store_id, len(rows), backoff,
+					)
+					self._failures[store_id] = (failures, now + backoff)
+					self._requeue(store_id, rows)
+				else:
+					self._failures.pop(store_id, None)
+
+	def _requeue(self, store_id: str, rows: List[tuple]) -> None:
+		# Ahead of newer rows to keep order. Not added to _count, so rows waiting on a
+		# failing store do not keep waking the writer for another flush.
+		with self._lock:
+			self._pending.setdefault(store_id, [])[:0] = rows
+
+	def _run(self) -> None:
+		while True:
+			self._wakeup.wait(AUDIT_FLUSH_INTERVAL)
+			self._wakeup.clear()
+			self.flush()
+
+
+_audit_writer = _AuditWriter()
+atexit.register(_audit_writer.flush)
+
+
+def flush_audit_log() -> None:
+	"""Write any buffered audit rows now."""
+	_audit_writer.flush()
+
+
+def _audit(
+	conn: sqlite3.Connection,
+	medicine_id: int,
+	action: str,
+	before: Optional[Dict[str, Any]],
+	after: Optional[Dict[str, Any]],
+) -> Optional[tuple]:
+	"""
+	Record a before/after snapshot of a medicine change made on conn.
+
+	In buffered mode the row is returned instead of queued; pass it to _queue_audit
+	once the change has committed, so rolled-back changes are never logged.
 	"""
-	conn = sqlite3.connect(DB_PATH)
-	conn.row_factory = sqlite3.Row
-	# Ensure FK constraints are enforced
-	conn.execute("PRAGMA foreign_keys = ON;")
-	return conn
+	row = (
+		medicine_id,
+		action,
+		json.dumps(before) if before is not None else None,
+		json.dumps(after) if after is not None else None,
+		datetime.utcnow().isoformat(),
+	)
+	if AUDIT_SYNC:
+		# Same transaction as the change: committed (or rolled back) together
+		conn.execute(_AUDIT_INSERT_SQL, row)
+		return None
+	return row
+
+
+def _queue_audit(row: Optional[tuple]) -> None:
+	"""Hand a committed change's audit row to the background writer."""
+	if row is not None:
+		_audit_writer.add(get_current_store(), row)
+
+
+def _fetch_medicine(conn: sqlite3.Connection, medicine_id: int) -> Optional[Dict[str, Any]]:
+	row = conn.execute(
+		f"SELECT {_MEDICINE_COLUMNS} FROM medicines WHERE id = ?",
+		(medicine_id,),
+	).fetchone()
+	return dict(row) if row else None
 
 
 def add_medicine(name: str, manufacturer: str, batch_no: str, expiry_date: str, quantity: int, price: float) -> int:
@@ -29,8 +354,11 @@ def add_medicine(name: str, manufacturer: str, batch_no: str, expiry_date: str,
 			""",
 			(name, manufacturer, batch_no, expiry_date, quantity, price),
 		)
+		medicine_id = cursor.lastrowid
+		audit_row = _audit(conn, medicine_id, "create", None, _fetch_medicine(conn, medicine_id))
 		conn.commit()
-		return cursor.lastrowid
+		_queue_audit(audit_row)
+		return medicine_id
 	finally:
 		conn.close()
 
@@ -51,6 +379,9 @@ def update_medicine(medicine_id: int, name: str, manufacturer: str, batch_no: st
 	"""Update all editable fields for a medicine."""
 	conn = get_db_connection()
 	try:
+		# Take the write lock first so the audited before-values cannot go stale
+		conn.execute("BEGIN IMMEDIATE")
+		before = _fetch_medicine(conn, medicine_id)
 		conn.execute(
 			"""
 			UPDATE medicines
@@ -59,7 +390,9 @@ def update_medicine(medicine_id: int, name: str, manufacturer: str, batch_no: st
 			""",
 			(name, manufacturer, batch_no, expiry_date, quantity, price, medicine_id),
 		)
+		audit_row = _audit(conn, medicine_id, "update", before, _fetch_medicine(conn, medicine_id)) if before else None
 		conn.commit()
+		_queue_audit(audit_row)
 	finally:
 		conn.close()
 
@@ -68,8 +401,12 @@ def delete_medicine(medicine_id: int) -> None:
 	"""Delete a medicine by id."""
 	conn = get_db_connection()
 	try:
+		conn.execute("BEGIN IMMEDIATE")
+		before = _fetch_medicine(conn, medicine_id)
 		conn.execute("DELETE FROM medicines WHERE id = ?", (medicine_id,))
+		audit_row = _audit(conn, medicine_id, "delete", before, None) if before else None
 		conn.commit()
+		_queue_audit(audit_row)
 	finally:
 		conn.close()
 
@@ -78,11 +415,17 @@ def update_medicine_stock(medicine_id: int, new_quantity: int) -> None:
 	"""Update stock quantity for a medicine."""
 	conn = get_db_connection()
 	try:
+		conn.execute("BEGIN IMMEDIATE")
+		before = conn.execute("SELECT quantity FROM medicines WHERE id = ?", (medicine_id,)).fetchone()
 		conn.execute(
 			"UPDATE medicines SET quantity = ? WHERE id = ?",
 			(new_quantity, medicine_id),
 		)
+		audit_row = None
+		if before:
+			audit_row = _audit(conn, medicine_id, "stock", {"quantity": before["quantity"]}, {"quantity": new_quantity})
 		conn.commit()
+		_queue_audit(audit_row)
 	finally:
 		conn.close()
 
@@ -100,6 +443,78 @@ def get_medicine_by_id(medicine_id: int) -> Optional[Dict[str, Any]]:
 		conn.close()
 
 
+def _insert_sale(
+	cursor: sqlite3.Cursor,
+	customer_name: str,
+	sale_items: List[Dict[str, Any]],
+	sale_date: Optional[str] = None,
+	idempotency_key: Optional[str] = None,
+) -> int:
+	"""
+	Validate and insert one sale on an open transaction, reducing inventory.
+
+	Raises ValueError when an item is invalid or stock is insufficient. The caller
+	owns the transaction and must roll back (or roll back to a savepoint) on error.
+	"""
+	total_amount = 0.0
+	resolved_items: List[Dict[str, Any]] = []
+
+	for item in sale_items:
+		medicine_id = int(item["medicine_id"]) if "medicine_id" in item else int(item["id"])  # allow id alias
+		quantity = int(item["quantity"]) if "quantity" in item else int(item.get("quantity_sold", 0))
+		if quantity <= 0:
+			raise ValueError("Quantity must be greater than zero")
+
+		med_row = cursor.execute(
+			"SELECT id, name, quantity, price FROM medicines WHERE id = ?",
+			(medicine_id,),
+		).fetchone()
+		if not med_row:
+			raise ValueError(f"Medicine with id {medicine_id} not found")
+
+		current_quantity = int(med_row["quantity"])  # type: ignore[index]
+		if current_quantity < quantity:
+			raise ValueError(f"Insufficient stock for medicine id {medicine_id}")
+
+		price_per_item = float(item.get("price", med_row["price"]))  # type: ignore[index]
+		line_total = price_per_item * quantity
+		total_amount += line_total
+
+		resolved_items.append(
+			{
+				"medicine_id": medicine_id,
+				"quantity": quantity,
+				"price_per_item": price_per_item,
+			}
+		)
+
+	# Insert sale header
+	if not sale_date:
+		sale_date = datetime.utcnow().isoformat()
+	cursor.execute(
+		"INSERT INTO sales (customer_name, sale_date, total_amount, idempotency_key) VALUES (?, ?, ?, ?)",
+		(customer_name, sale_date, total_amount, idempotency_key),
+	)
+	sale_id = cursor.lastrowid
+
+	# Insert sale items and update stock
+	for r_item in resolved_items:
+		cursor.execute(
+			"""
+			INSERT INTO sale_items (sale_id, medicine_id, quantity_sold, price_per_item)
+			VALUES (?, ?, ?, ?)
+			""",
+			(sale_id, r_item["medicine_id"], r_item["quantity"], r_item["price_per_item"]),
+		)
+		# Decrement stock
+		cursor.execute(
+			"UPDATE medicines SET quantity = quantity - ? WHERE id = ?",
+			(r_item["quantity"], r_item["medicine_id"]),
+		)
+
+	return int(sale_id)
+
+
 def record_sale(customer_name: str, sale_items: List[Dict[str, Any]]) -> int:
 	"""
 	Record a sale and reduce inventory accordingly.
@@ -115,67 +530,106 @@ def record_sale(customer_name: str, sale_items: List[Dict[str, Any]]) -> int:
 	conn = get_db_connection()
 	try:
 		cursor = conn.cursor()
-		# Begin transaction
-		cursor.execute("BEGIN")
+		# Take the write lock up front; a deferred BEGIN fails with "database is locked"
+		# when two sales read stock and then both try to upgrade to a write lock
+		cursor.execute("BEGIN IMMEDIATE")
+		sale_id = _insert_sale(cursor, customer_name, sale_items)
+		conn.commit()
+		return sale_id
+	except Exception:
+		conn.rollback()
+		raise
+	finally:
+		conn.close()
+
 
-		total_amount = 0.0
-		resolved_items: List[Dict[str, Any]] = []
+def record_sales_batch(sales: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+	"""
+	Apply a backlog of sales queued by an offline terminal in a single transaction.
 
-		for item in sale_items:
-			medicine_id = int(item["medicine_id"]) if "medicine_id" in item else int(item["id"])  # allow id alias
-			quantity = int(item["quantity"]) if "quantity" in item else int(item.get("quantity_sold", 0))
-			if quantity <= 0:
-				raise ValueError("Quantity must be greater than zero")
+	Args:
+		sales: List of sales with keys: idempotency_key (str), customer_name (str optional),
+		items (list, same shape as record_sale), sale_date (ISO str optional).
+		sale_date lets a terminal keep the time the sale actually happened at the counter.
 
-			med_row = cursor.execute(
-				"SELECT id, name, quantity, price FROM medicines WHERE id = ?",
-				(medicine_id,),
+	Returns:
+		One result per sale, in input order, with keys idempotency_key, status and
+		sale_id or message. Status is "created", "duplicate" (key already applied, the
+		original sale_id is returned) or "conflict" (e.g. insufficient stock, no items,
+		invalid sale_date; nothing from that sale is applied). A conflict does not
+		affect the other sales.
+	"""
+	results: List[Dict[str, Any]] = []
+	conn = get_db_connection()
+	try:
+		cursor = conn.cursor()
+		# One transaction for the whole batch so a large backlog costs a single commit.
+		# IMMEDIATE serialises concurrent uploads so the key lookup below stays valid.
+		cursor.execute("BEGIN IMMEDIATE")
+
+		for sale in sales:
+			key = str(sale.get("idempotency_key") or "").strip()
+			if not key:
+				results.append({"idempotency_key": None, "status": "conflict", "message": "idempotency_key is required"})
+				continue
+
+			existing = cursor.execute(
+				"SELECT id FROM sales WHERE idempotency_key = ?",
+				(key,),
 			).fetchone()
-			if not med_row:
-				raise ValueError(f"Medicine with id {medicine_id} not found")
-
-			current_quantity = int(med_row["quantity"])  # type: ignore[index]
-			if current_quantity < quantity:
-				raise ValueError(f"Insufficient stock for medicine id {medicine_id}")
-
-			price_per_item = float(item.get("price", med_row["price"]))  # type: ignore[index]
-			line_total = price_per_item * quantity
-			total_amount += line_total
-
-			resolved_items.append(
-				{
-					"medicine_id": medicine_id,
-					"quantity": quantity,
-					"price_per_item": price_per_item,
-				}
-			)
-
-		# Insert sale header
-		from datetime import datetime
-		sale_date = datetime.utcnow().isoformat()
-		cursor.execute(
-			"INSERT INTO sales (customer_name, sale_date, total_amount) VALUES (?, ?, ?)",
-			(customer_name, sale_date, total_amount),
-		)
-		sale_id = cursor.lastrowid
-
-		# Insert sale items and update stock
-		for r_item in resolved_items:
-			cursor.execute(
-				"""
-				INSERT INTO sale_items (sale_id, medicine_id, quantity_sold, price_per_item)
-				VALUES (?, ?, ?, ?)
-				""",
-				(sale_id, r_item["medicine_id"], r_item["quantity"], r_item["price_per_item"]),
-			)
-			# Decrement stock
-			cursor.execute(
-				"UPDATE medicines SET quantity = quantity - ? WHERE id = ?",
-				(r_item["quantity"], r_item["medicine_id"]),
-			)
+			if existing:
+				results.append({"idempotency_key": key, "status": "duplicate", "sale_id": int(existing["id"])})
+				continue
+
+			items = sale.get("items") or sale.get("sale_items") or []
+			# Savepoint per sale so a conflict only undoes that sale
+			cursor.execute("SAVEPOINT batch_sale")
+			try:
+				if not isinstance(items, list) or not items:
+					raise ValueError("items must be a non-empty list")
+				customer_name = sale.get("customer_name") or ""
+				if not isinstance(customer_name, str):
+					raise ValueError("customer_name must be a string")
+				sale_date = sale.get("sale_date") or None
+				if sale_date is not None:
+					if not isinstance(sale_date, str):
+						raise ValueError("sale_date must be an ISO date string")
+					# Store naive UTC like utcnow() so reports grouping on substr(sale_date, 1, 10)
+					# and date ordering agree with sales recorded online
+					parsed = datetime.fromisoformat(sale_date.strip())
+					if parsed.tzinfo is not None:
+						parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+					sale_date = parsed.isoformat()
+				sale_id = _insert_sale(
+					cursor,
+					customer_name.strip(),
+					items,
+					sale_date=sale_date,
+					idempotency_key=key,
+				)
+			except sqlite3.IntegrityError as exc:
+				cursor.execute("ROLLBACK TO SAVEPOINT batch_sale")
+				cursor.execute("RELEASE SAVEPOINT batch_sale")
+				existing = cursor.execute(
+					"SELECT id FROM sales WHERE idempotency_key = ?",
+					(key,),
+				).fetchone()
+				if existing:
+					results.append({"idempotency_key": key, "status": "duplicate", "sale_id": int(existing["id"])})
+				else:
+					results.append({"idempotency_key": key, "status": "conflict", "message": str(exc)})
+				continue
+			except (ValueError, KeyError, TypeError, AttributeError, OverflowError) as exc:
+				cursor.execute("ROLLBACK TO SAVEPOINT batch_sale")
+				cursor.execute("RELEASE SAVEPOINT batch_sale")
+				message = str(exc) if isinstance(exc, ValueError) else f"Invalid sale item: {exc}"
+				results.append({"idempotency_key": key, "status": "conflict", "message": message})
+				continue
+			cursor.execute("RELEASE SAVEPOINT batch_sale")
+			results.append({"idempotency_key": key, "status": "created", "sale_id": sale_id})
 
 		conn.commit()
-		return int(sale_id)
+		return results
 	except Exception:
 		conn.rollback()
 		raise
@@ -183,7 +637,56 @@ def record_sale(customer_name: str, sale_items: List[Dict[str, Any]]) -> int:
 		conn.close()
 
 
+def get_audit_log(
+	medicine_id: Optional[int] = None,
+	start: Optional[str] = None,
+	end: Optional[str] = None,
+	limit: int = 500,
+) -> List[Dict[str, Any]]:
+	"""
+	Return medicine audit entries, newest first.
 
+	Args:
+		medicine_id: Only entries for this medicine.
+		start: Inclusive lower bound on changed_at (ISO date or datetime).
+		end: Exclusive upper bound on changed_at (ISO date or datetime).
+		limit: Maximum number of entries.
+	"""
+	# Include changes still waiting in the buffer (waits for a background flush in progress)
+	flush_audit_log()
+	clauses: List[str] = []
+	params: List[Any] = []
+	if medicine_id is not None:
+		clauses.append("medicine_id = ?")
+		params.append(medicine_id)
+	if start:
+		clauses.append("changed_at >= ?")
+		params.append(start)
+	if end:
+		clauses.append("changed_at < ?")
+		params.append(end)
+	where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+	conn = get_db_connection()
+	try:
+		rows = conn.execute(
+			f"""
+			SELECT id, medicine_id, action, before_json, after_json, changed_at
+			FROM medicine_audit_log
+			{where}
+			ORDER BY changed_at DESC, id DESC
+			LIMIT ?
+			""",
+			(*params, limit),
+		).fetchall()
+		entries = []
+		for row in rows:
+			entry = dict(row)
+			entry["before"] = json.loads(entry.pop("before_json")) if row["before_json"] else None
+			entry["after"] = json.loads(entry.pop("after_json")) if row["after_json"] else None
+			entries.append(entry)
+		return entries
+	finally:
+		conn.close()
 
 
 def get_summary_stats() -> Dict[str, Any]:
@@ -234,9 +737,26 @@ def get_dashboard_stats() -> Dict[str, Any]:
 		conn.close()
 
 
+_user_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_user_cache_lock = threading.Lock()
+# Bumped on every invalidation so a lookup racing with a write does not re-cache a stale row
+_user_cache_generation = 0
+
+
+def invalidate_user_cache(username: Optional[str] = None) -> None:
+	"""Drop a cached user row, or every cached row when username is None."""
+	global _user_cache_generation
+	with _user_cache_lock:
+		_user_cache_generation += 1
+		if username is None:
+			_user_cache.clear()
+		else:
+			_user_cache.pop(username, None)
+
+
 def add_user(username: str, password_hash: str, role: str = 'staff') -> int:
-	"""Create a new user and return id."""
-	conn = get_db_connection()
+	"""Create a new user and return id. Users are shared, so they live in the main store."""
+	conn = get_db_connection(DEFAULT_STORE)
 	try:
 		cursor = conn.cursor()
 		cursor.execute(
@@ -247,19 +767,77 @@ def add_user(username: str, password_hash: str, role: str = 'staff') -> int:
 		return cursor.lastrowid
 	finally:
 		conn.close()
+		invalidate_user_cache(username)
+
+
+def update_user_password(username: str, password_hash: str) -> None:
+	"""Replace a user's password hash."""
+	conn = get_db_connection(DEFAULT_STORE)
+	try:
+		conn.execute(
+			"UPDATE users SET password_hash = ? WHERE username = ?",
+			(password_hash, username),
+		)
+		conn.commit()
+	finally:
+		conn.close()
+		invalidate_user_cache(username)
+
+
+def get_user_stores(user_id: int) -> List[str]:
+	"""Return the stores a user may log in to; users with no assignment get the main store."""
+	conn = get_db_connection(DEFAULT_STORE)
+	try:
+		rows = conn.execute(
+			"SELECT store_id FROM user_stores WHERE user_id = ? ORDER BY store_id ASC",
+			(user_id,),
+		).fetchall()
+		return [row["store_id"] for row in rows] or [DEFAULT_STORE]
+	finally:
+		conn.close()
+
+
+def set_user_stores(user_id: int, store_ids: List[str]) -> None:
+	"""Replace the stores a user may log in to."""
+	known = set(list_stores())
+	for store_id in store_ids:
+		if store_id not in known:
+			raise ValueError(f"Unknown store: {store_id}")
+	conn = get_db_connection(DEFAULT_STORE)
+	try:
+		conn.execute("BEGIN IMMEDIATE")
+		conn.execute("DELETE FROM user_stores WHERE user_id = ?", (user_id,))
+		conn.executemany(
+			"INSERT INTO user_stores (user_id, store_id) VALUES (?, ?)",
+			[(user_id, store_id) for store_id in dict.fromkeys(store_ids)],
+		)
+		conn.commit()
+	finally:
+		conn.close()
 
 
 def get_user_by_username(username: str) -> Optional[Dict[str, Any]]:
-	"""Get a user by username, or None."""
-	conn = get_db_connection()
+	"""Get a user by username, or None. Found rows are cached for USER_CACHE_TTL seconds."""
+	with _user_cache_lock:
+		cached = _user_cache.get(username)
+		generation = _user_cache_generation
+	if cached and time.monotonic() - cached[0] < USER_CACHE_TTL:
+		return dict(cached[1])
+	conn = get_db_connection(DEFAULT_STORE)
 	try:
 		row = conn.execute(
 			"SELECT id, username, password_hash, role FROM users WHERE username = ?",
 			(username,),
 		).fetchone()
-		return dict(row) if row else None
 	finally:
 		conn.close()
+	if not row:
+		return None
+	user = dict(row)
+	with _user_cache_lock:
+		if generation == _user_cache_generation:
+			_user_cache[username] = (time.monotonic(), user)
+	return dict(user)
 
 
 def list_sales() -> List[Dict[str, Any]]:
@@ -301,3 +879,30 @@ def get_sale_details(sale_id: int) -> Dict[str, Any]:
 		conn.close()
 
 
+def get_summary_stats_all_stores() -> Dict[str, Any]:
+	"""Return summary metrics summed across all stores, plus each store's own."""
+	per_store = fan_out(get_summary_stats)
+	totals: Dict[str, Any] = {"total_medicines": 0, "total_units": 0, "low_stock": 0, "sales_today": 0.0, "sales_count": 0}
+	for stats in per_store.values():
+		for key in totals:
+			totals[key] += stats[key]
+	return {"totals": totals, "stores": per_store}
+
+
+def get_dashboard_stats_all_stores() -> Dict[str, Any]:
+	"""Return dashboard KPIs summed across all stores, plus each store's own."""
+	per_store = fan_out(get_dashboard_stats)
+	totals: Dict[str, Any] = {"total_revenue": 0.0, "low_stock_count": 0, "total_medicines": 0}
+	for stats in per_store.values():
+		for key in totals:
+			totals[key] += stats[key]
+	return {"totals": totals, "stores": per_store}
+
+
+def list_sales_all_stores() -> List[Dict[str, Any]]:
+	"""Return sales from every store, newest first, tagged with store_id."""
+	merged: List[Dict[str, Any]] = []
+	for store_id, sales in fan_out(list_sales).items():
+		merged.extend({**sale, "store_id": store_id} for sale in sales)
+	merged.sort(key=lambda sale: sale["sale_date"] or "", reverse=True)
+	return merged
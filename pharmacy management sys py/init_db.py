@@ -1,13 +1,14 @@
 import sqlite3
 
 
-def create_tables() -> None:
+def create_tables(db_path: str = "pharmacy.db", seed: bool = True) -> None:
 	"""
 	Create database tables for the pharmacy management system.
 	This script is intended to be run once to initialize pharmacy.db.
+	It is also used to initialize a new store's shard, with seed=False.
 	"""
 
-	connection = sqlite3.connect("pharmacy.db")
+	connection = sqlite3.connect(db_path)
 	cursor = connection.cursor()
 	try:
 		# Enable foreign keys for referential integrity
@@ -36,7 +37,7 @@ def create_tables() -> None:
 
 		# Seed sample medicines if none exist
 		med_count = cursor.execute("SELECT COUNT(*) FROM medicines").fetchone()[0]
-		if not med_count:
+		if seed and not med_count:
 			medicines = [
 				("Paracetamol 500mg", "Mankind", "BCH1001", "2026-12-31", 100, 12.5),
 				("Cetrizine 10mg", "Mankind", "BCH1002", "2027-05-30", 50, 8.0),
@@ -64,10 +65,20 @@ def create_tables() -> None:
 				id INTEGER PRIMARY KEY,
 				customer_name TEXT,
 				sale_date TEXT,
-				total_amount REAL NOT NULL DEFAULT 0
+				total_amount REAL NOT NULL DEFAULT 0,
+				idempotency_key TEXT
 			);
 			"""
 		)
+		# Add idempotency_key column if missing (for existing DBs)
+		cols = cursor.execute("PRAGMA table_info(sales)").fetchall()
+		col_names = {c[1] for c in cols}
+		if "idempotency_key" not in col_names:
+			cursor.execute("ALTER TABLE sales ADD COLUMN idempotency_key TEXT")
+		# Terminal-generated keys must be unique so replayed uploads are deduplicated
+		cursor.execute(
+			"CREATE UNIQUE INDEX IF NOT EXISTS idx_sales_idempotency_key ON sales (idempotency_key)"
+		)
 
 		# Create sale_items table
 		cursor.execute(
@@ -102,6 +113,49 @@ def create_tables() -> None:
 		if "role" not in col_names:
 			cursor.execute("ALTER TABLE users ADD COLUMN role TEXT NOT NULL DEFAULT 'staff'")
 
+		# Stores each staff user may log in to (read from the main store only)
+		cursor.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS user_stores (
+				user_id INTEGER NOT NULL,
+				store_id TEXT NOT NULL,
+				PRIMARY KEY (user_id, store_id),
+				FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+			);
+			"""
+		)
+
+		# Create medicine audit log (no FK so history survives medicine deletion)
+		cursor.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS medicine_audit_log (
+				id INTEGER PRIMARY KEY,
+				medicine_id INTEGER NOT NULL,
+				action TEXT NOT NULL,
+				before_json TEXT,
+				after_json TEXT,
+				changed_at TEXT NOT NULL
+			);
+			"""
+		)
+		cursor.execute(
+			"CREATE INDEX IF NOT EXISTS idx_audit_medicine_time ON medicine_audit_log (medicine_id, changed_at)"
+		)
+		cursor.execute(
+			"CREATE INDEX IF NOT EXISTS idx_audit_time ON medicine_audit_log (changed_at)"
+		)
+		# Audit rows are append-only
+		for op in ("UPDATE", "DELETE"):
+			cursor.execute(
+				f"""
+				CREATE TRIGGER IF NOT EXISTS medicine_audit_log_no_{op.lower()}
+				BEFORE {op} ON medicine_audit_log
+				BEGIN
+					SELECT RAISE(ABORT, 'medicine_audit_log is append-only');
+				END;
+				"""
+			)
+
 		connection.commit()
 
 		# Create sales table
@@ -157,5 +211,11 @@ def create_tables() -> None:
 if __name__ == "__main__":
 	create_tables()
 	print("pharmacy.db initialized successfully.")
+	# Bring every other store's shard up to the current schema
+	from database import DEFAULT_STORE, get_store_db_path, list_stores
+	for store_id in list_stores():
+		if store_id != DEFAULT_STORE:
+			create_tables(get_store_db_path(store_id), seed=False)
+			print(f"Store {store_id} migrated.")
 
 